@@ -39,8 +39,8 @@ Programmatic (e.g., from R with reticulate):
 
 from __future__ import annotations
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import math
 import re
 import sys
 import warnings
@@ -64,41 +64,57 @@ DEFAULT_OUTPUT = Path("output/AMAV_DATA.xlsx")
 # ---------------- Utilities ----------------
 def to_number(series: pd.Series) -> pd.Series:
     """Robust numeric conversion: handles %, comma decimals, and thousand separators."""
-    def _one(x):
-        if pd.isna(x):
-            return np.nan
-        if isinstance(x, (int, float, np.number)):
-            return float(x)
-        s = str(x).strip().replace(" ", "")
-        is_pct = s.endswith("%")
-        s = s.replace("%", "").replace(",", ".")
-        # remove thousands separators like 1.234 or 1'234
-        s = re.sub(r"(?<=\d)[\.,'’](?=\d{3}\b)", "", s)
-        try:
-            v = float(s)
-        except ValueError:
-            return np.nan
-        return v / 100.0 if is_pct else v
-    return series.apply(_one)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    s = series.astype("string").str.strip().str.replace(" ", "", regex=False)
+    is_pct = s.str.endswith("%").fillna(False).to_numpy(bool)
+    s = s.str.replace("%", "", regex=False).str.replace(",", ".", regex=False)
+    # remove thousands separators like 1.234 or 1'234
+    s = s.str.replace(r"(?<=\d)[\.,'’](?=\d{3}\b)", "", regex=True)
+    v = pd.to_numeric(s, errors="coerce").astype(float)
+    v[is_pct] = v[is_pct] / 100.0
+    return v
 
 
 def runs_true(mask: np.ndarray) -> List[Tuple[int, int]]:
     """Return [(start, end)] index intervals where mask is True and contiguous."""
-    idx = np.where(mask)[0]
-    if idx.size == 0:
+    m = np.asarray(mask, dtype=bool)
+    if m.size == 0 or not m.any():
         return []
-    runs, start, prev = [], idx[0], idx[0]
-    for k in idx[1:]:
-        if k == prev + 1:
-            prev = k
-        else:
-            runs.append((start, prev))
-            start = prev = k
-    runs.append((start, prev))
-    return runs
+    # Run boundaries fall where the mask flips; patch in the array edges.
+    edges = np.diff(m.astype(np.int8))
+    starts = np.flatnonzero(edges == 1) + 1
+    ends = np.flatnonzero(edges == -1)
+    if m[0]:
+        starts = np.r_[0, starts]
+    if m[-1]:
+        ends = np.r_[ends, m.size - 1]
+    return list(zip(starts.tolist(), ends.tolist()))
 
 
 # -------- AMAV / AMAV-POS core --------
+def perstudy_linearslope_arr(years: np.ndarray, V: np.ndarray) -> np.ndarray:
+    """
+    Slope matrix for a (Y x k) block of trend values over sorted years.
+    For each trend, piecewise-constant slope between successive observed points.
+    """
+    finite = np.isfinite(V)
+    S = np.full(V.shape, np.nan, float)
+    for j in range(V.shape[1]):
+        obs_idx = np.flatnonzero(finite[:, j])
+        if obs_idx.size < 2:
+            continue
+        obs_y = years[obs_idx]
+        obs_v = V[obs_idx, j]
+        # Piecewise-constant slope per segment; each year in
+        # (obs_y[i], obs_y[i+1]] gets slopes[i].
+        slopes = np.diff(obs_v) / np.diff(obs_y)
+        seg_idx = np.searchsorted(obs_y, years, side="left") - 1
+        valid = (years > obs_y[0]) & (years <= obs_y[-1])
+        S[valid, j] = slopes[seg_idx[valid]]
+    return S
+
+
 def build_perstudy_linearslope(raw_df: pd.DataFrame) -> pd.DataFrame:
     """
     raw_df columns: Year | T1 | T2 | ... | Tk
@@ -106,42 +122,22 @@ def build_perstudy_linearslope(raw_df: pd.DataFrame) -> pd.DataFrame:
     """
     df = raw_df.sort_values("Year").reset_index(drop=True)
     years = df["Year"].to_numpy()
-    out = pd.DataFrame({"Year": years})
+    study_cols = [c for c in df.columns if c != "Year"]
 
-    for col in df.columns:
-        if col == "Year":
-            continue
-        s = pd.to_numeric(df[col], errors="coerce")
-        mask = s.notna().to_numpy()
-        obs_y = years[mask]
-        obs_v = s[mask].to_numpy(float)
-
-        arr = np.full(len(years), np.nan, float)
-        for i in range(len(obs_y) - 1):
-            y0, y1 = obs_y[i], obs_y[i + 1]
-            v0, v1 = obs_v[i],  obs_v[i + 1]
-            if y1 > y0:
-                slope = (v1 - v0) / (y1 - y0)
-                seg = (years > y0) & (years <= y1)
-                arr[seg] = slope
-        out[col] = arr
+    # Single bulk conversion to a (Y x k) matrix; the slope kernel is pure NumPy.
+    V = df[study_cols].apply(pd.to_numeric, errors="coerce").to_numpy(float)
+    S = perstudy_linearslope_arr(years, V)
 
+    out = pd.DataFrame(S, columns=study_cols)
+    out.insert(0, "Year", years)
     return out
 
 
-def build_summary_mav_amav(slope_df: pd.DataFrame) -> pd.DataFrame:
+def summary_mav_amav_arr(years: np.ndarray, M: np.ndarray) -> pd.DataFrame:
     """
-    - MAV: mean across study slopes per year.
-    - AMAV: cumulative MAV within the last contiguous block where MAV is defined.
-    - AMAV-POS: if AMAV dips below zero in that block, accumulate MAV from the year
-      after the valley (MODE='prev'), including negative MAV if INCLUDE_NEG=True.
+    Summary DataFrame from a (Y x k) slope matrix over sorted years.
+    See build_summary_mav_amav for the MAV/AMAV/AMAV-POS semantics.
     """
-    df = slope_df.sort_values("Year").reset_index(drop=True)
-    years = df["Year"].to_numpy()
-
-    study_cols = [c for c in df.columns if c != "Year"]
-    M = df[study_cols].to_numpy(float)
-
     datapoints = np.sum(~np.isnan(M), axis=1)
     with np.errstate(all="ignore"):
         mav = np.nanmean(M, axis=1)
@@ -153,13 +149,9 @@ def build_summary_mav_amav(slope_df: pd.DataFrame) -> pd.DataFrame:
     last_s = last_e = None
     if mav_runs:
         last_s, last_e = mav_runs[-1]
-        acc = 0.0
-        # i from last_s+1 .. last_e+1 inclusive (AMAV[i] integrates mav[i-1])
-        for i in range(last_s + 1, last_e + 2):
-            prev = i - 1
-            if not math.isnan(mav[prev]):
-                acc += mav[prev]
-            amav[i] = acc
+        # AMAV[i] integrates mav[i-1]; mav is finite on the whole run
+        # [last_s, last_e], so the block is a plain cumulative sum.
+        amav[last_s + 1:last_e + 2] = np.cumsum(mav[last_s:last_e + 1])
 
     summary = pd.DataFrame({
         "Year": years,
@@ -182,37 +174,55 @@ def build_summary_mav_amav(slope_df: pd.DataFrame) -> pd.DataFrame:
     valley = lo + valley_rel
 
     amav_pos = np.full(len(amav), np.nan, float)
-    run = 0.0
-
-    # Start at valley+1 for MODE='prev'
-    start_i = max(valley + 1, lo) if MODE == "prev" else max(valley, lo)
-    for i in range(start_i, hi + 1):
-        idx_mav = (i - 1) if MODE == "prev" else i
-        v = mav[idx_mav]
-        if np.isfinite(v):
-            contrib = v if INCLUDE_NEG else max(v, 0.0)
-            run += contrib
-            amav_pos[i] = run
+
+    # Start at valley+1 for MODE='prev'; src holds the MAV values each
+    # output index accumulates (mav[i-1] for 'prev', mav[i] otherwise).
+    if MODE == "prev":
+        start_i = max(valley + 1, lo)
+        src = mav[start_i - 1:hi]
+    else:
+        start_i = max(valley, lo)
+        src = mav[start_i:hi + 1]
+    fin = np.isfinite(src)
+    contrib = np.where(fin, src if INCLUDE_NEG else np.maximum(src, 0.0), 0.0)
+    run = np.cumsum(contrib)
+    amav_pos[start_i:hi + 1][fin] = run[fin]
 
     insert_at = list(summary.columns).index("AMAV") + 1
     summary.insert(insert_at, "AMAV-POS", amav_pos)
     return summary
 
 
-def first_positive_baseline(s: pd.Series) -> float:
-    """First non-zero, non-NA value."""
-    for v in s:
-        if pd.notna(v) and v != 0:
-            return float(v)
-    return np.nan
+def build_summary_mav_amav(slope_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    - MAV: mean across study slopes per year.
+    - AMAV: cumulative MAV within the last contiguous block where MAV is defined.
+    - AMAV-POS: if AMAV dips below zero in that block, accumulate MAV from the year
+      after the valley (MODE='prev'), including negative MAV if INCLUDE_NEG=True.
+    """
+    df = slope_df.sort_values("Year").reset_index(drop=True)
+    years = df["Year"].to_numpy()
+    study_cols = [c for c in df.columns if c != "Year"]
+    M = df[study_cols].to_numpy(float)
+    return summary_mav_amav_arr(years, M)
+
+
+def first_positive_baselines(df: pd.DataFrame) -> np.ndarray:
+    """First non-zero, non-NA value per column (NaN for all-empty columns)."""
+    A = df.to_numpy(float)
+    valid = ~np.isnan(A) & (A != 0)
+    idx = valid.argmax(axis=0)
+    base = A[idx, np.arange(A.shape[1])]
+    base[~valid.any(axis=0)] = np.nan
+    return base
 
 
 # -------- Read single table from Supplemental(ary)_Table_1 --------
-def find_table_sheet(xlsx: Path) -> str:
+def find_table_sheet(xls: pd.ExcelFile) -> str:
     """Find the sheet whose (0,0) cell is 'Phenotype' (fallback: first sheet)."""
-    xls = pd.ExcelFile(xlsx)
     for sh in xls.sheet_names:
-        test = pd.read_excel(xlsx, sheet_name=sh, nrows=1, header=None)
+        # parse() reuses the already-opened workbook instead of re-reading it
+        test = xls.parse(sheet_name=sh, nrows=1, header=None)
         if not test.empty and str(test.iat[0, 0]).strip().lower() == "phenotype":
             return sh
     return xls.sheet_names[0]
@@ -225,9 +235,32 @@ def read_single_table(input_xlsx: Path) -> tuple[pd.DataFrame, List[int]]:
     - year_order: sorted list of integer years
 
     Drops the 'Citation' column. Removes a header-like duplicate row if needed.
+
+    The parsed table is cached as a Parquet sidecar next to the workbook and
+    reused while it is newer than the .xlsx (Parquet loads far faster than
+    the openpyxl XML parse).
     """
-    sheet = find_table_sheet(input_xlsx)
-    df = pd.read_excel(input_xlsx, sheet_name=sheet, header=0)
+    cache = input_xlsx.with_suffix(".parquet")
+    if cache.exists() and cache.stat().st_mtime >= input_xlsx.stat().st_mtime:
+        df = pd.read_parquet(cache)
+        # Parquet requires string column names; years go back to int
+        df.columns = [c if c == "Phenotype" else int(c) for c in df.columns]
+        year_cols = [c for c in df.columns if c != "Phenotype"]
+        return df, year_cols
+
+    df, year_cols = _parse_single_table(input_xlsx)
+    try:
+        df.rename(columns=str).to_parquet(cache)
+    except Exception:
+        pass  # cache is best-effort (read-only data dir, missing pyarrow, ...)
+    return df, year_cols
+
+
+def _parse_single_table(input_xlsx: Path) -> tuple[pd.DataFrame, List[int]]:
+    """Parse the wide table out of the Excel workbook (cold path)."""
+    xls = pd.ExcelFile(input_xlsx)
+    sheet = find_table_sheet(xls)
+    df = xls.parse(sheet_name=sheet, header=0)
     if df.empty:
         raise SystemExit("Input sheet appears to be empty.")
 
@@ -272,31 +305,67 @@ def read_single_table(input_xlsx: Path) -> tuple[pd.DataFrame, List[int]]:
     return df, year_cols
 
 
-def build_disease_series(df: pd.DataFrame, year_order: List[int]) -> Dict[str, pd.Series]:
+def _disease_series_task(task: Tuple[str, List[int], np.ndarray]):
+    """
+    Worker for one phenotype: (disease, years, trends-matrix) -> (disease, Series).
+    Returns None when all trends are NA. Module-level so it pickles for workers.
+    """
+    disease, years, values = task
+
+    # values has one trend per row; the kernels want a (Y x k) block
+    V = values.T
+    years_arr = np.asarray(years)
+
+    # Skip if all trends are NA
+    if not np.isfinite(V).any():
+        return None
+
+    S = perstudy_linearslope_arr(years_arr, V)
+    summary = summary_mav_amav_arr(years_arr, S)
+
+    chosen_col = "AMAV-POS" if ("AMAV-POS" in summary.columns and summary["AMAV-POS"].notna().any()) else "AMAV"
+    ser = summary.set_index("Year")[chosen_col].copy()
+    ser.name = disease
+    return disease, ser
+
+
+def build_disease_series(df: pd.DataFrame, year_order: List[int],
+                         pool: ProcessPoolExecutor | None = None) -> Dict[str, pd.Series]:
     """
     For each phenotype, build a per-disease AMAV/AMAV-POS series,
     preferring AMAV-POS when present, else AMAV.
+
+    Diseases are independent, so they are dispatched to a process pool;
+    each task ships only small float arrays, not DataFrames. Pass an
+    existing pool to reuse its warmed-up workers (import costs are paid
+    once per worker); otherwise a temporary pool is created for this call.
     """
-    series_by: Dict[str, pd.Series] = {}
     years = list(year_order)
 
-    for disease, grp in df.groupby("Phenotype", dropna=True):
-        raw = pd.DataFrame({"Year": years})
-        # Each row in grp is one trend (T1..Tk)
-        for i, (_, row) in enumerate(grp.iterrows(), start=1):
-            raw[f"T{i}"] = row[years].values
-
-        # Skip if all trends are NA
-        if raw.drop(columns=["Year"]).isna().all().all():
-            continue
-
-        slope = build_perstudy_linearslope(raw)
-        summary = build_summary_mav_amav(slope)
+    # One stable sort, then contiguous index-range slices per phenotype --
+    # same groups (and order) as groupby, without per-group index rebuilds.
+    sdf = df.sort_values("Phenotype", kind="stable").reset_index(drop=True)
+    keys, starts = np.unique(sdf["Phenotype"].to_numpy(), return_index=True)
+    ends = np.r_[starts[1:], len(sdf)]
+    tasks = [
+        (disease, years, sdf.iloc[s:e][years].to_numpy(float))
+        for disease, s, e in zip(keys, starts, ends)
+    ]
+
+    own_pool = None
+    if pool is None:
+        pool = own_pool = ProcessPoolExecutor()
+    try:
+        results = list(pool.map(_disease_series_task, tasks))
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
 
-        chosen_col = "AMAV-POS" if ("AMAV-POS" in summary.columns and summary["AMAV-POS"].notna().any()) else "AMAV"
-        ser = summary.set_index("Year")[chosen_col].copy()
-        ser.name = disease
-        series_by[disease] = ser
+    series_by: Dict[str, pd.Series] = {}
+    for res in results:
+        if res is not None:
+            disease, ser = res
+            series_by[disease] = ser
 
     return series_by
 
@@ -339,20 +408,36 @@ def resolve_input_output(
     return inp, out
 
 
+def _stream_sheet(xw: pd.ExcelWriter, df: pd.DataFrame, sheet_name: str) -> None:
+    """
+    Write one DataFrame strictly row by row. constant_memory mode flushes
+    each row as soon as the next one starts, so cells must arrive in row
+    order (to_excel emits them column by column and would be dropped).
+    """
+    ws = xw.book.add_worksheet(sheet_name)
+    header_fmt = xw.book.add_format(
+        {"bold": True, "border": 1, "align": "center", "valign": "top"}
+    )
+    ws.write_row(0, 0, [str(c) for c in df.columns], header_fmt)
+    for r, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        ws.write_row(r, 0, [None if pd.isna(v) else v for v in row])
+
+
 def write_workbook(amav_df: pd.DataFrame, folds_y: pd.DataFrame,
                    folds_rel: pd.DataFrame, log_df: pd.DataFrame, out_path: Path) -> None:
     """Write the 4 output sheets to an Excel workbook."""
-    with pd.ExcelWriter(out_path, engine="xlsxwriter") as xw:
-        amav_df.reset_index().rename(columns={"index": "Year"}).to_excel(
-            xw, index=False, sheet_name="AMAV"
-        )
-        folds_y.reset_index().rename(columns={"index": "Year"}).to_excel(
-            xw, index=False, sheet_name="FOLD_YEARLY"
-        )
-        folds_rel.rename_axis("RelYear").reset_index().to_excel(
-            xw, index=False, sheet_name="FOLD_RELATIVE"
-        )
-        log_df.to_excel(xw, index=False, sheet_name="LOG_used_column")
+    with pd.ExcelWriter(
+        out_path,
+        engine="xlsxwriter",
+        engine_kwargs={"options": {"constant_memory": True}},
+    ) as xw:
+        _stream_sheet(xw, amav_df.reset_index().rename(columns={"index": "Year"}),
+                      "AMAV")
+        _stream_sheet(xw, folds_y.reset_index().rename(columns={"index": "Year"}),
+                      "FOLD_YEARLY")
+        _stream_sheet(xw, folds_rel.rename_axis("RelYear").reset_index(),
+                      "FOLD_RELATIVE")
+        _stream_sheet(xw, log_df, "LOG_used_column")
 
 
 # ---------------- Orchestrator ----------------
@@ -367,7 +452,9 @@ def build_amav(input_xlsx: str | Path | None = None,
     )
 
     df, year_order = read_single_table(inp)
-    series_by = build_disease_series(df, year_order)
+    # One pool for every per-disease stage of the run
+    with ProcessPoolExecutor() as pool:
+        series_by = build_disease_series(df, year_order, pool=pool)
     if not series_by:
         raise SystemExit("No diseases could be parsed into AMAV/AMAV-POS series.")
 
@@ -377,19 +464,18 @@ def build_amav(input_xlsx: str | Path | None = None,
     for disease, s in series_by.items():
         amav_df[disease] = s.reindex(all_years)
 
+    # One vectorized scan gives every disease's first positive baseline
+    baselines = first_positive_baselines(amav_df)
+
     # FOLD_YEARLY: normalised by first positive baseline, indexed by Year
-    folds_y = pd.DataFrame(index=amav_df.index)
-    for col in amav_df.columns:
-        v = amav_df[col]
-        b = first_positive_baseline(v.dropna())
-        folds_y[col] = v / b if pd.notna(b) else np.nan
+    # (columns without a baseline divide by NaN and stay all-NaN)
+    folds_y = amav_df / baselines
 
     # FOLD_RELATIVE: same but re-indexed 0..n per disease
     rel_dict: Dict[str, pd.Series] = {}
     max_len = 0
-    for col in amav_df.columns:
+    for b, col in zip(baselines, amav_df.columns):
         v = amav_df[col].dropna()
-        b = first_positive_baseline(v)
         rel = (v / b) if pd.notna(b) else pd.Series(dtype=float)
         rel.index = range(len(rel))
         rel_dict[col] = rel